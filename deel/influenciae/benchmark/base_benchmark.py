@@ -9,15 +9,24 @@ task will be the detection of mislabeled examples (synthetically generated by ad
 noise to labels in the training set) by looking at the most self-influential examples.
 """
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import io
 import os
 import random
 import json
 
 import tensorflow as tf
 import numpy as np
+from matplotlib.figure import Figure
 from tensorflow.keras.optimizers import Optimizer # pylint: disable=E0611
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from .influence_factory import InfluenceCalculatorFactory
+from ..plots import BenchmarkDisplay
 from ..types import Tuple, Dict, Any, Optional, List
 
 
@@ -96,6 +105,9 @@ class MislabelingDetectorEvaluator:
         An integer with the size of the batches on which to perform the validation.
     config
         A dictionary with the configuration to save it alongside the results for traceability.
+    distribute_strategy
+        An (optional) TF distribution strategy (e.g. tf.distribute.MirroredStrategy) under whose scope
+        the models are trained, for spreading each evaluation's training over the available devices.
     """
 
     def __init__(
@@ -108,7 +120,8 @@ class MislabelingDetectorEvaluator:
             train_batch_size: int = 128,
             test_batch_size: int = 128,
             influence_batch_size: Optional[int] = None,
-            config: Optional[Dict] = None) -> None:
+            config: Optional[Dict] = None,
+            distribute_strategy: Optional[tf.distribute.Strategy] = None) -> None:
         assert 0. < mislabeling_ratio < 1.
         self.training_dataset = training_dataset
         self.train_batch_size = train_batch_size
@@ -127,6 +140,11 @@ class MislabelingDetectorEvaluator:
         else:
             self.config = config
 
+        if distribute_strategy is None:
+            self.distribute_strategy = tf.distribute.get_strategy()
+        else:
+            self.distribute_strategy = distribute_strategy
+
     def bench(
             self,
             influence_calculator_factories: Dict[str, InfluenceCalculatorFactory],
@@ -134,7 +152,8 @@ class MislabelingDetectorEvaluator:
             path_to_save: str,
             seed: int = 0,
             verbose: bool = True,
-            use_tensorboard: bool = False
+            use_tensorboard: bool = False,
+            top_k: Optional[int] = None
     ) -> Dict[str, Tuple[np.array, np.array, float]]:
         """
         Performs the whole benchmark for a group of influence calculator techniques and a number of
@@ -155,6 +174,9 @@ class MislabelingDetectorEvaluator:
             A boolean indicating whether progress is reported in stdout or not.
         use_tensorboard
             A boolean indicating if the results are to be progressively logged into tensorboard.
+        top_k
+            An (optional) integer for only ranking the top-k most self-influential examples. If None,
+            the whole dataset is ranked.
 
         Returns
         -------
@@ -167,7 +189,7 @@ class MislabelingDetectorEvaluator:
                 print("starting to evaluate=" + str(name))
 
             curves, mean_curve, roc = self.evaluate(influence_calculator_factory, nbr_of_evaluation, seed, verbose,
-                                                    path_to_save, use_tensorboard, name)
+                                                    path_to_save, use_tensorboard, name, top_k)
 
             result[name] = (curves, mean_curve, roc)
 
@@ -184,7 +206,8 @@ class MislabelingDetectorEvaluator:
             verbose: bool = True,
             path_to_save: Optional[str] = None,
             use_tensorboard: bool = False,
-            method_name: Optional[str] = None
+            method_name: Optional[str] = None,
+            top_k: Optional[int] = None
     ) -> Tuple[np.array, np.array, float]:
         """
         Performs one benchmark evaluation over one influence calculator technique the specified number
@@ -206,13 +229,24 @@ class MislabelingDetectorEvaluator:
             A boolean indicating if the results are to be progressively logged into tensorboard.
         method_name
             An optional string with the experience's name.
+        top_k
+            An (optional) integer for only ranking the top-k most self-influential examples, in which case
+            the curves will only cover this part of the dataset. If None, the whole dataset is ranked.
 
         Returns
         -------
         curves, mean_curve, roc
             A tuple with the experience's results: (each of the individual curves, the mean curve, the ROC)
         """
-        curves = []
+        assert top_k is None or top_k > 0
+
+        # the curves all have the same length, so they can be stored in a preallocated array
+        curve_length = self._training_dataset_size()
+        if top_k is not None:
+            curve_length = min(top_k, curve_length)
+        curves = np.empty((nbr_of_evaluation, curve_length), dtype=np.float32)
+        # running sum of the curves, for keeping the saved mean curve up to date without recomputing it
+        sum_curve = None
 
         if use_tensorboard and (path_to_save is None):
             path_to_save = "./"
@@ -221,20 +255,16 @@ class MislabelingDetectorEvaluator:
             dirname = path_to_save + "/" + method_name
             if not os.path.exists(dirname):
                 os.makedirs(dirname)
-            with open(dirname + "/config.json", 'w', encoding="utf-8") as fp:
-                json.dump(self.config, fp, indent=4)
+            self.__save_config(dirname + "/config.json")
 
         if method_name is None:
             method_name = 'experiment'
 
-        for index in range(nbr_of_evaluation):
-
-            if use_tensorboard:
-                experiment_name = method_name + "_" + str(index)
+        if use_tensorboard:
+            # a single writer for all the seeds, their curves are told apart by their tag
+            file_writer = tf.summary.create_file_writer(path_to_save + "/" + method_name)
 
-                file_writer = tf.summary.create_file_writer(path_to_save + "/" + method_name + "/seed" + str(index),
-                                                            filename_suffix=experiment_name)
-                tf_writer = file_writer.as_default()
+        for index in range(nbr_of_evaluation):
 
             tf.keras.backend.clear_session()
             self.set_seed(seed + index)
@@ -242,24 +272,27 @@ class MislabelingDetectorEvaluator:
             noisy_training_dataset, noisy_label_indexes = self.build_noisy_training_dataset()
             noisy_label_indexes = noisy_label_indexes[0]
 
-            acc_train, acc_test, model, data_train = self.training_procedure.train(
-                noisy_training_dataset,
-                self.test_dataset,
-                self.train_batch_size,
-                self.test_batch_size,
-                log_path=None if path_to_save is None else path_to_save + "/" + method_name + "/seed" + str(index))
+            with self.distribute_strategy.scope():
+                acc_train, acc_test, model, data_train = self.training_procedure.train(
+                    noisy_training_dataset,
+                    self.test_dataset,
+                    self.train_batch_size,
+                    self.test_batch_size,
+                    log_path=None if path_to_save is None else path_to_save + "/" + method_name + "/seed" + str(index))
 
+            factory_training_dataset = noisy_training_dataset.shuffle(1000) if influence_factory.requires_shuffle \
+                else noisy_training_dataset
             influence_calculator = influence_factory.build(
-                noisy_training_dataset.shuffle(1000).batch(self.influence_batch_size), model, data_train)
+                factory_training_dataset.batch(self.influence_batch_size), model, data_train)
 
             influences_values = influence_calculator._compute_influence_values(  # pylint: disable=W0212
-                noisy_training_dataset.batch(self.influence_batch_size))
+                noisy_training_dataset.batch(self.influence_batch_size).prefetch(tf.data.AUTOTUNE))
 
             # compute curve and indexes
-            sorted_influences_indexes = np.argsort(-np.squeeze(influences_values))
+            sorted_influences_indexes = self._sort_influences_indexes(influences_values, top_k)
 
             sorted_curve = self.__compute_curve(sorted_influences_indexes, noisy_label_indexes)
-            curves.append(sorted_curve)
+            curves[index] = sorted_curve
 
             roc = self._compute_roc(sorted_curve)
             if verbose:
@@ -267,17 +300,20 @@ class MislabelingDetectorEvaluator:
                     acc_test) + " | roc=" + str(roc))
 
             if use_tensorboard:
-                with tf_writer:
+                with file_writer.as_default():
                     tf.summary.scalar("roc_value", roc, index)
-                    self.plot_tensorboard_roc(sorted_curve, "roc_curve")
+                    self.plot_tensorboard_roc(sorted_curve, "seed" + str(index) + "/roc_curve")
 
             if path_to_save is not None:
-                curves_, mean_curve_, roc_ = self.__build(curves)
-                self.__save(path_to_save + "/" + method_name + "/data.npy", curves_, mean_curve_, roc_)
+                sum_curve = sorted_curve if sum_curve is None else sum_curve + sorted_curve
+                mean_curve_ = sum_curve / (index + 1)
+                roc_ = self._compute_roc(mean_curve_)
+                self.__save(path_to_save + "/" + method_name + "/data.npz", curves[:index + 1], mean_curve_, roc_)
 
         curves, mean_curve, roc = self.__build(curves)
 
         if use_tensorboard:
+            file_writer.close()
             file_writer = tf.summary.create_file_writer(path_to_save + "/synthesis/" + method_name + "/")
             with file_writer.as_default():
                 tf.summary.scalar("roc_mean", roc, 0)
@@ -289,7 +325,7 @@ class MislabelingDetectorEvaluator:
     @staticmethod
     def plot_tensorboard_roc(curve: np.ndarray, experiment_name: str):
         """
-        Plots a mislabeled samples detection ROC curve on tensorboard.
+        Plots a mislabeled samples detection ROC curve on tensorboard, as a single image.
 
         Parameters
         ----------
@@ -298,28 +334,64 @@ class MislabelingDetectorEvaluator:
         experiment_name
             A string with the experiment's name
         """
-        for i, c in enumerate(curve):
-            tf.summary.scalar(experiment_name, c, i)
+        curve_length = len(curve)
+        # the figure is not managed by pyplot, so it does not have to be closed
+        fig = Figure()
+        ax = fig.add_subplot()
+        ax.plot(np.linspace(0., 1., curve_length), curve, 'C0')
+        BenchmarkDisplay.draw_detection_axis(ax, curve_length)
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+
+        image = tf.image.decode_png(buffer.getvalue(), channels=4)
+        tf.summary.image(experiment_name, tf.expand_dims(image, axis=0), step=0)
 
-    def __build(self, curves: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray, float]:
+    def __build(self, curves: np.ndarray) -> Tuple[np.ndarray, np.ndarray, float]:
         """
-        Formats the curves, computes the mean curve and the ROC.
+        Computes the mean curve and the ROC.
 
         Parameters
         ----------
         curves
-            A list with the experiment's curves mislabeled sample detection curves.
+            A 2D numpy array with the experiment's mislabeled sample detection curves, one per row.
         Returns
         -------
         curves, mean_curve, roc
-            A tuple with: (curves in numpy array format, the mean curve, the roc value)
+            A tuple with: (the curves, the mean curve, the roc value)
         """
-        curves = np.asarray(curves)
-        mean_curve = np.mean(curves, axis=0)
+        # the ROC is reduced from the (K times smaller) mean curve rather than re-reading all the curves
+        mean_curve = curves.mean(axis=0)
         roc = self._compute_roc(mean_curve)
 
         return curves, mean_curve, roc
 
+    @staticmethod
+    def _sort_influences_indexes(influences_values: np.ndarray, top_k: Optional[int] = None) -> np.ndarray:
+        """
+        Sorts the samples' indices by decreasing self-influence.
+
+        Parameters
+        ----------
+        influences_values
+            An array with the self-influence of each sample.
+        top_k
+            An (optional) integer for only sorting the top-k most self-influential samples. If None,
+            all the samples are sorted.
+
+        Returns
+        -------
+        sorted_influences_indexes
+            A numpy array with the (top-k) sample's indices sorted by their self-influence.
+        """
+        influences_values = -np.squeeze(influences_values)
+        if top_k is None or top_k >= influences_values.shape[0]:
+            return np.argsort(influences_values)
+
+        # only the top-k need to be ordered, so partition first and sort them afterwards
+        top_k_indexes = np.argpartition(influences_values, top_k - 1)[:top_k]
+        return top_k_indexes[np.argsort(influences_values[top_k_indexes])]
+
     @staticmethod
     def _compute_roc(curve: np.array) -> float:
         """
@@ -335,7 +407,7 @@ class MislabelingDetectorEvaluator:
         roc
             The roc value.
         """
-        roc = np.mean(curve)
+        roc = float(np.mean(curve))
         return roc
 
     @staticmethod
@@ -361,7 +433,8 @@ class MislabelingDetectorEvaluator:
         Parameters
         ----------
         sorted_influences_indexes
-            A numpy array with the sample's indices sorted by their self-influence.
+            A numpy array with the sample's indices sorted by their self-influence. It may only contain
+            the top-most self-influential samples.
         noisy_label_indexes
             A numpy array with the dataset's mislabeled examples' ground-truth.
 
@@ -370,14 +443,33 @@ class MislabelingDetectorEvaluator:
         curve
             A numpy array with the detection curve as we progressively scan the dataset.
         """
-        index = np.in1d(sorted_influences_indexes, noisy_label_indexes)
-        index = tf.cast(index, dtypes=np.int32)
-        curve = np.cumsum(index)
-        if curve[-1] != 0:
-            curve = curve / curve[-1]
+        sorted_influences_indexes = np.asarray(sorted_influences_indexes)
+        noisy_label_indexes = np.asarray(noisy_label_indexes)
+        mask_size = max(np.max(sorted_influences_indexes), np.max(noisy_label_indexes, initial=-1)) + 1
+        mask = np.zeros(mask_size, dtype=np.int32)
+        mask[noisy_label_indexes] = 1
+        index = mask[sorted_influences_indexes]
+        curve = np.cumsum(index, dtype=np.float32)
+        # normalize with all the mislabeled examples, not only the ones found in the (eventually partial) ranking
+        nb_noisy_labels = np.sum(mask)
+        if nb_noisy_labels != 0:
+            curve /= nb_noisy_labels
 
         return curve
 
+    def _training_dataset_size(self) -> int:
+        """
+        Gets the number of samples of the training dataset, which is required to be known in advance.
+
+        Returns
+        -------
+        dataset_size
+            An integer with the training dataset's cardinality.
+        """
+        dataset_size = int(self.training_dataset.cardinality())
+        assert dataset_size > 0, "The training dataset must have a known and finite cardinality"
+        return dataset_size
+
     def build_noisy_training_dataset(self) -> Tuple[tf.data.Dataset, np.array]:
         """
         Generates a noisy version of the object's own dataset. In particular, it will include noise
@@ -392,28 +484,44 @@ class MislabelingDetectorEvaluator:
             A tuple with the noisy dataset and a numpy array with the flipped labels (used for validation
             during the evaluation).
         """
-        dataset_size = tf.data.experimental.cardinality(self.training_dataset)
+        dataset_size = self._training_dataset_size()
+        inputs, labels = self.training_dataset.batch(dataset_size).get_single_element()
+        labels = labels.numpy()
+
         noise_mask = np.random.uniform(size=(dataset_size,)) > self.mislabeling_ratio
-        noise_mask_dataset = tf.data.Dataset.from_tensor_slices(noise_mask)
-        noisy_dataset = tf.data.Dataset.zip((self.training_dataset, noise_mask_dataset))
-
-        def noise_map(z, y_mask):
-            """
-            Flips a single sample's labels following the mask.
-            """
-            (x, y) = z
-            y_noise = tf.random.uniform(shape=(1,)) * tf.cast((tf.shape(y)[-1] - 1), dtype=tf.float32)
-            y_noise = tf.cond(y_noise > tf.cast(tf.argmax(y), dtype=tf.float32), lambda: y_noise + 1, lambda: y_noise)
-            y_noise = tf.cast(y_noise, dtype=tf.int32)
-            y_noise = tf.cast(tf.squeeze(tf.one_hot(y_noise, tf.shape(y)[-1]), axis=0), dtype=y.dtype)
-            y = tf.where(y_mask, y, y_noise)
-            return x, y
-
-        noisy_dataset = noisy_dataset.map(noise_map)
+
+        # draw a new label among the other classes for every sample and keep it only where the mask says so
+        original_labels = np.argmax(labels, axis=-1)
+        random_labels = np.random.randint(0, self.nb_classes - 1, size=(dataset_size,))
+        random_labels += random_labels >= original_labels
+        noisy_labels = np.eye(self.nb_classes, dtype=labels.dtype)[random_labels]
+        noisy_labels = np.where(noise_mask[:, None], labels, noisy_labels)
+
+        noisy_dataset = tf.data.Dataset.from_tensor_slices((inputs, noisy_labels))
 
         noise_indexes = np.where(np.logical_not(noise_mask))
         return noisy_dataset, noise_indexes
 
+    def __save_config(self, path_to_save: str) -> None:
+        """
+        Saves the configuration to the disk as a JSON file, using orjson if it is available. Both paths
+        indent the file with 2 spaces, the only indentation supported by orjson.
+
+        Parameters
+        ----------
+        path_to_save
+            A string with the path of the JSON file.
+        """
+        if orjson is not None:
+            with open(path_to_save, 'wb') as fp:
+                fp.write(orjson.dumps(
+                    self.config,
+                    option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+                ))
+        else:
+            with open(path_to_save, 'w', encoding="utf-8") as fp:
+                json.dump(self.config, fp, indent=2)
+
     @staticmethod
     def __save(path_to_save: str, curves: np.array, mean_curve: np.array, roc: float) -> None:
         """
@@ -422,7 +530,8 @@ class MislabelingDetectorEvaluator:
         Parameters
         ----------
         path_to_save
-            A string with the path into which to save the results.
+            A string with the path into which to save the results, as a .npz archive with the curves,
+            mean_curve and roc entries.
         curves
             A numpy array with the different detection curves.
         mean_curve
@@ -433,7 +542,7 @@ class MislabelingDetectorEvaluator:
         dirname = os.path.dirname(path_to_save)
         if not os.path.exists(dirname):
             os.makedirs(dirname)
-        np.save(path_to_save, np.array((curves, mean_curve, roc), dtype=object), allow_pickle=True)
+        np.savez_compressed(path_to_save, curves=curves, mean_curve=mean_curve, roc=np.float64(roc))
 
 
 class ModelsSaver(tf.keras.callbacks.Callback):
@@ -441,6 +550,12 @@ class ModelsSaver(tf.keras.callbacks.Callback):
     A simple class to save models after optimizer updates. It will prove itself useful for tracing the
     different information to be able to use the TracIn method.
 
+    Only snapshots of the model's weights are taken at the end of the epochs, which avoids cloning the
+    whole model after each of them and keeps the epochs' latency low. The models themselves are rebuilt
+    on demand: get_models builds an independent model for each checkpoint (e.g. for TracIn, which needs
+    all of them at once), while model_at restores a single checkpoint into a shared model. This is not a
+    memory saving: after get_models, the snapshots and the rebuilt models are both held in memory.
+
     Parameters
     ----------
     epochs_to_save
@@ -448,7 +563,8 @@ class ModelsSaver(tf.keras.callbacks.Callback):
     optimizer
         The model's optimizer.
     saving_path
-        An (optional) string for saving the results on the disk.
+        An (optional) string for saving the results on the disk. The checkpoints' weights are saved
+        as model_ep_{epoch}.npz archives.
     """
 
     def __init__(self, epochs_to_save: List[int], optimizer: Optimizer, saving_path: Optional[str] = None, **kwargs):
@@ -456,13 +572,18 @@ class ModelsSaver(tf.keras.callbacks.Callback):
         self.epochs_to_save = epochs_to_save
         self.optimizer = optimizer
 
-        self.models = []
+        self.checkpoint_weights = []
         self.learning_rates = []
+        self._template = None
 
         if saving_path is not None and not os.path.exists(saving_path):
             os.mkdir(saving_path)
         self.saving_path = saving_path
 
+        # the checkpoints are written to the disk in the background to not block the training
+        self._executor = None
+        self._pending_writes = []
+
     def on_epoch_end(self, epoch: int, logs: Optional[Dict] = None) -> None:
         """
         Save the relevant training information (model, learning rate, save to disk if desired)
@@ -479,16 +600,85 @@ class ModelsSaver(tf.keras.callbacks.Callback):
             values of the Model's metrics are returned.
         """
         if epoch in self.epochs_to_save:
-            epoch_model = tf.keras.models.clone_model(self.model)
-            epoch_model.build(self.model.input_shape)
-            epoch_model.set_weights(self.model.get_weights())
-
             epoch_lr = self.optimizer.lr
-            self.models.append(epoch_model)
+            self.checkpoint_weights.append(self.model.get_weights())
             self.learning_rates.append(epoch_lr.numpy())
 
             if self.saving_path is not None:
-                tf.data.experimental.save(f"{self.saving_path}/model_ep_{epoch:.6d}")
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1)
+                self._pending_writes.append(self._executor.submit(
+                    np.savez_compressed, f"{self.saving_path}/model_ep_{epoch:06d}.npz", *self.checkpoint_weights[-1]))
                 np.save(f"{self.saving_path}/learning_rates", np.array(self.learning_rates), allow_pickle=True)
                 with open(f"{self.saving_path}/logs.json", "w", encoding='utf8') as f:
                     json.dump(logs, f)
+
+    def on_train_end(self, logs: Optional[Dict] = None) -> None:  # pylint: disable=W0613
+        """
+        Waits for the checkpoints that are still being written to the disk, re-raising any error that
+        occurred while writing them, and stops the writing thread at the end of the training.
+
+        Parameters
+        ----------
+        logs
+            Dict, currently the output of the last call to on_epoch_end() is passed to this argument
+            for this method but that may change in the future.
+        """
+        pending_writes, self._pending_writes = self._pending_writes, []
+        try:
+            for write in pending_writes:
+                write.result()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def _clone_model(self) -> tf.keras.Model:
+        """
+        Clones the architecture of the model being trained.
+
+        Returns
+        -------
+        model
+            A freshly built copy of the model, with its own weights.
+        """
+        model = tf.keras.models.clone_model(self.model)
+        model.build(self.model.input_shape)
+        return model
+
+    def model_at(self, index: int) -> tf.keras.Model:
+        """
+        Restores the model's checkpoint with the given index into a template model that is shared
+        among all the checkpoints. As such, the returned model is only valid until the next call.
+
+        Parameters
+        ----------
+        index
+            An integer with the index of the checkpoint in the list of saved checkpoints.
+
+        Returns
+        -------
+        model
+            The shared template model with the weights of the checkpoint.
+        """
+        if self._template is None:
+            self._template = self._clone_model()
+        self._template.set_weights(self.checkpoint_weights[index])
+        return self._template
+
+    def get_models(self) -> List[tf.keras.Model]:
+        """
+        Rebuilds an independent model for each of the saved checkpoints, for the methods that require
+        all of them at once (e.g. TracIn).
+
+        Returns
+        -------
+        models
+            A list with a model for each saved checkpoint.
+        """
+        models = []
+        for weights in self.checkpoint_weights:
+            model = self._clone_model()
+            model.set_weights(weights)
+            models.append(model)
+        return models
@@ -230,7 +230,7 @@ class Cifar10TrainingProcedure(BaseTrainingProcedure):
         _, test_stats = model.evaluate(test_dataset, batch_size=test_batch_size, verbose=0)
 
         if self.epochs_to_save is not None:
-            return train_stats, test_stats, model, (model_saver.models, model_saver.learning_rates)
+            return train_stats, test_stats, model, (model_saver.get_models(), model_saver.learning_rates)
 
         return train_stats, test_stats, model, None
 
@@ -268,6 +268,8 @@ class Cifar10MislabelingDetectorEvaluator(MislabelingDetectorEvaluator):
         A boolean indicating if progress about the training procedures should be reported to stdout.
     use_tensorboard
         A boolean indicating the use of tensorboard for logging.
+    distribute_strategy
+        An (optional) TF distribution strategy under whose scope the models are trained.
     """
     def __init__(
             self,
@@ -283,7 +285,8 @@ class Cifar10MislabelingDetectorEvaluator(MislabelingDetectorEvaluator):
             epochs_to_save: Optional[List[int]] = None,
             take_batch: Optional[int] = None,
             verbose_training: bool = True,
-            use_tensorboard: bool = False
+            use_tensorboard: bool = False,
+            distribute_strategy: Optional[tf.distribute.Strategy] = None
         ): # pylint: disable=R0913
 
         config = {
@@ -319,4 +322,5 @@ class Cifar10MislabelingDetectorEvaluator(MislabelingDetectorEvaluator):
                          train_batch_size=train_batch_size,
                          test_batch_size=test_batch_size,
                          influence_batch_size=influence_batch_size,
-                         config=config)
+                         config=config,
+                         distribute_strategy=distribute_strategy)
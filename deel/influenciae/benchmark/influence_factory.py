@@ -30,6 +30,19 @@ class InfluenceCalculatorFactory:
     An interface for factories generating instances of the different influence calculators.
     """
 
+    @property
+    def requires_shuffle(self) -> bool:
+        """
+        Whether the training dataset should be shuffled before building the influence calculator. Only
+        needed by the factories that use a part of it (e.g. for estimating the hessian) or train on it.
+
+        Returns
+        -------
+        requires_shuffle
+            A boolean, False by default.
+        """
+        return False
+
     @abstractmethod
     def build(self, training_dataset: tf.data.Dataset, model: tf.keras.Model,
               train_info: Any) -> BaseInfluenceCalculator:
@@ -54,7 +67,27 @@ class InfluenceCalculatorFactory:
         raise NotImplementedError
 
 
-class FirstOrderFactory(InfluenceCalculatorFactory):
+class _HessianSubsetFactoryMixin:
+    """
+    A mixin for the factories that can estimate the hessian matrix on a part of the training dataset,
+    chosen through their dataset_hessian_size attribute.
+    """
+    dataset_hessian_size: int
+
+    @property
+    def requires_shuffle(self) -> bool:
+        """
+        Whether the training dataset should be shuffled before building the influence calculator.
+
+        Returns
+        -------
+        requires_shuffle
+            True if only a part of the training dataset is used for estimating the hessian matrix.
+        """
+        return self.dataset_hessian_size is not None and self.dataset_hessian_size >= 0
+
+
+class FirstOrderFactory(_HessianSubsetFactoryMixin, InfluenceCalculatorFactory):
     """
     A factory for creating instances of FirstOrderInfluenceCalculator objects.
 
@@ -138,7 +171,7 @@ class FirstOrderFactory(InfluenceCalculatorFactory):
         return influence_calculator
 
 
-class RPSLJEFactory(InfluenceCalculatorFactory):
+class RPSLJEFactory(_HessianSubsetFactoryMixin, InfluenceCalculatorFactory):
     """
     A factory for creating instances of representer point LJE objects.
 
@@ -296,6 +329,18 @@ class RPSL2Factory(InfluenceCalculatorFactory):
         self.epochs = epochs
         self.layer_index = layer_index
 
+    @property
+    def requires_shuffle(self) -> bool:
+        """
+        Whether the training dataset should be shuffled before building the influence calculator.
+
+        Returns
+        -------
+        requires_shuffle
+            True, as the surrogate last layer is trained on the training dataset.
+        """
+        return True
+
     def build(self, training_dataset: tf.data.Dataset, model: tf.keras.Model,
               train_info: Any = None) -> RepresenterPointL2:
         """
@@ -398,7 +443,7 @@ class SampleBoundaryCalculatorFactory(InfluenceCalculatorFactory):
         return SampleBoundaryCalculator(model, self.step_nbr)
 
 
-class ArnoldiCalculatorFactory(InfluenceCalculatorFactory):
+class ArnoldiCalculatorFactory(_HessianSubsetFactoryMixin, InfluenceCalculatorFactory):
     """
     A factory for creating instances of ArnoldiInfluenceCalculator objects.
 
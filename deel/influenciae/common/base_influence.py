@@ -103,11 +103,9 @@ class SelfInfluenceCalculator:
         influences_values = influences_values.map(
             lambda _, inf_val: inf_val
         )
-        inf_val = None
-        for batch_inf in influences_values:
-            inf_val = batch_inf if inf_val is None else tf.concat([inf_val, batch_inf], axis=0)
-
-        return inf_val
+        # the batches are gathered and concatenated at once, to avoid copying the growing tensor at each batch
+        batches_inf = list(influences_values)
+        return tf.concat(batches_inf, axis=0) if batches_inf else None
 
     def compute_top_k_from_training_dataset(
             self,
@@ -10,6 +10,7 @@ import os
 
 import numpy as np
 from matplotlib import pyplot as plt
+from matplotlib.axes import Axes
 
 from ..types import Dict, Tuple, Optional
 
@@ -23,7 +24,7 @@ class BenchmarkDisplay:
     @staticmethod
     def load_bench_result(path: str) -> Dict[str, Tuple[np.array, np.array, float]]:
         """
-        Loads an evaluation's or whole benchmark's results.
+        Loads an evaluation's results, saved as a .npz archive in the experiment's directory.
 
         Parameters
         ----------
@@ -33,11 +34,32 @@ class BenchmarkDisplay:
         Returns
         -------
         results
-            A dictionary with the experiments' names and their corresponding results (curves, mean curve, roc)
+            A dictionary with the experiment's name (i.e. the name of its directory) and its corresponding
+            results (curves, mean curve, roc)
         """
-        result = np.load(os.path.join(path), allow_pickle=True)
+        name = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        with np.load(path) as data:
+            result = {name: (data["curves"], data["mean_curve"], float(data["roc"]))}
         return result
 
+    @staticmethod
+    def draw_detection_axis(ax: Axes, curve_length: int) -> None:
+        """
+        Draws the elements shared by all the mislabeled samples detection plots on an axis: the curve
+        of a random search and the axis' labels.
+
+        Parameters
+        ----------
+        ax
+            The matplotlib axis on which to draw.
+        curve_length
+            An integer with the number of points of the curves plotted on the axis.
+        """
+        ax.plot(np.linspace(0., 1., curve_length), np.linspace(0., 1., curve_length), 'C1')
+        ax.set_xlabel('Part of the dataset searched')
+        ax.set_ylabel('Part of mislabeled found')
+        ax.grid('minor')
+
     @staticmethod
     def plot_bench_from_path(path: str, path_to_save: str = None) -> None:
         """
@@ -93,12 +115,9 @@ class BenchmarkDisplay:
             axs[i].plot(np.linspace(0., 1., curve_length), mean_curv, 'C0')
             roc = np.mean(mean_curve)
 
-            axs[i].plot(np.linspace(0., 1., curve_length), np.linspace(0., 1., curve_length), 'C1')
+            BenchmarkDisplay.draw_detection_axis(axs[i], curve_length)
             axs[i].set_title(
                 f'Mislabeled detection {name} \n ROC={roc} \n Nbr of run={len(valid_curvs)}')
-            axs[i].set_xlabel('Part of the dataset searched')
-            axs[i].set_ylabel('Part of mislabeled found')
-            axs[i].grid('minor')
         if path_to_save is None:
             plt.show()
         else:
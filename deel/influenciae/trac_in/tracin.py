@@ -139,6 +139,7 @@ class TracIn(BaseInfluenceCalculator):
         influence_values = tf.matmul(preproc_test_sample, tf.transpose(influence_vector))
         return influence_values
 
+    @tf.function(jit_compile=True)
     def _compute_influence_value_from_batch(self, train_samples: Tuple[tf.Tensor, ...]) -> tf.Tensor:
         """
         Compute the influence score for a training sample
@@ -1,11 +1,18 @@
+import json
 import os
 import shutil
+import threading
 
 import tensorflow as tf
 import numpy as np
+import pytest
+from matplotlib import pyplot as plt
 
 from deel.influenciae.types import Optional, Tuple, Any
-from deel.influenciae.benchmark.base_benchmark import MislabelingDetectorEvaluator, BaseTrainingProcedure
+from deel.influenciae.benchmark import base_benchmark
+from deel.influenciae.benchmark.base_benchmark import MislabelingDetectorEvaluator, BaseTrainingProcedure, ModelsSaver
+from deel.influenciae.benchmark.influence_factory import FirstOrderFactory
+from deel.influenciae.plots import BenchmarkDisplay
 
 
 class MockTrainingProcedure(BaseTrainingProcedure):
@@ -17,6 +24,25 @@ class MockTrainingProcedure(BaseTrainingProcedure):
         raise NotImplementedError
 
 
+class DistributedTrainingProcedure(BaseTrainingProcedure):
+
+    def __init__(self):
+        self.strategies = []
+
+    def train(
+            self, training_dataset: tf.data.Dataset, test_dataset: tf.data.Dataset,
+            train_batch_size: int = 128, test_batch_size: int = 128,
+            log_path: Optional[str] = None) -> Tuple[float, float, tf.keras.Model, Any]:
+        self.strategies.append(tf.distribute.get_strategy())
+        model = tf.keras.Sequential([tf.keras.layers.Input(shape=(4,)), tf.keras.layers.Dense(3)])
+        model.compile(optimizer=tf.keras.optimizers.SGD(learning_rate=0.1),
+                      loss=tf.keras.losses.CategoricalCrossentropy(from_logits=True), metrics=["accuracy"])
+        model.fit(training_dataset.batch(train_batch_size), epochs=2, verbose=0)
+        _, acc_train = model.evaluate(training_dataset.batch(test_batch_size), verbose=0)
+        _, acc_test = model.evaluate(test_dataset.batch(test_batch_size), verbose=0)
+        return acc_train, acc_test, model, None
+
+
 def test_noise():
     np.random.seed(0)
     tf.random.set_seed(0)
@@ -55,6 +81,12 @@ def test_noise():
     curve_expected = [0.0, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 1.0, 1.0, 1.0]
     assert np.max(np.abs(curve - curve_expected)) < 1E-6
 
+    partial_curve = evaluator._MislabelingDetectorEvaluator__compute_curve(
+        sorted_influences_indexes=[2, 6, 3], noisy_label_indexes=[6, 8]
+    )
+    partial_curve_expected = [0.0, 0.5, 0.5]
+    assert np.max(np.abs(partial_curve - partial_curve_expected)) < 1E-6
+
     curves = [[0.0, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 1.0, 1.0, 1.0], [0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 1.0, 1.0, 1.0],
               [0.0, 0.0, 0.0, 0.5, 0.5, 0.5, 0.5, 1.0, 1.0, 1.0]]
     mean_curve = np.mean(curves, axis=0)
@@ -62,9 +94,272 @@ def test_noise():
 
     evaluator._MislabelingDetectorEvaluator__save("./tmp_test_bench_base/exp1", curves, mean_curve, roc)
 
-    result = np.load(os.path.join("./tmp_test_bench_base/exp1.npy"), allow_pickle=True)
+    with np.load(os.path.join("./tmp_test_bench_base/exp1.npz")) as result:
+        result_curves, result_mean_curve, result_roc = result["curves"], result["mean_curve"], result["roc"]
     shutil.rmtree("./tmp_test_bench_base/")
 
-    assert np.max(np.abs(curve - result[0][0])) < 1E-6
-    assert np.max(np.abs(mean_curve - result[1])) < 1E-6
-    assert np.max(np.abs(roc - result[2])) < 1E-6
+    assert np.max(np.abs(curve - result_curves[0])) < 1E-6
+    assert np.max(np.abs(mean_curve - result_mean_curve)) < 1E-6
+    assert np.max(np.abs(roc - result_roc)) < 1E-6
+
+
+def test_noise_reproducibility():
+    size = 1000
+    class_nbr = 10
+    x = tf.linspace(1, size, size)
+    y = tf.one_hot(np.arange(size) % class_nbr, class_nbr)
+    training_dataset = tf.data.Dataset.from_tensor_slices((x, y))
+
+    evaluator = MislabelingDetectorEvaluator(training_dataset,
+                                             test_dataset=None,
+                                             training_procedure=MockTrainingProcedure(),
+                                             nb_classes=class_nbr,
+                                             mislabeling_ratio=0.1)
+
+    noisy_labels, noise_indexes = [], []
+    for _ in range(2):
+        evaluator.set_seed(0)
+        noisy_dataset, noise_index = evaluator.build_noisy_training_dataset()
+        noisy_labels.append(np.stack([y_noisy for _, y_noisy in noisy_dataset.as_numpy_iterator()]))
+        noise_indexes.append(noise_index[0])
+
+    assert np.array_equal(noise_indexes[0], noise_indexes[1])
+    assert np.array_equal(noisy_labels[0], noisy_labels[1])
+    # the flipped labels are always different from the original ones
+    flipped_labels = np.argmax(noisy_labels[0][noise_indexes[0]], axis=-1)
+    original_labels = np.argmax(y.numpy()[noise_indexes[0]], axis=-1)
+    assert np.all(flipped_labels != original_labels)
+
+
+def test_unknown_cardinality():
+    size = 100
+    class_nbr = 10
+    x = tf.linspace(1, size, size)
+    y = tf.one_hot(np.arange(size) % class_nbr, class_nbr)
+    training_dataset = tf.data.Dataset.from_tensor_slices((x, y)).filter(lambda x, y: True)
+
+    evaluator = MislabelingDetectorEvaluator(training_dataset,
+                                             test_dataset=None,
+                                             training_procedure=MockTrainingProcedure(),
+                                             nb_classes=class_nbr,
+                                             mislabeling_ratio=0.1)
+
+    for evaluation in [evaluator.build_noisy_training_dataset,
+                       lambda: evaluator.evaluate(influence_factory=None, nbr_of_evaluation=1)]:
+        with pytest.raises(AssertionError, match="known and finite cardinality"):
+            evaluation()
+
+
+def test_bench_result_round_trip():
+    plt.switch_backend("Agg")
+    training_dataset = tf.data.Dataset.from_tensor_slices((tf.zeros((10, 1)), tf.zeros((10, 2))))
+    evaluator = MislabelingDetectorEvaluator(training_dataset,
+                                             test_dataset=None,
+                                             training_procedure=MockTrainingProcedure(),
+                                             nb_classes=2,
+                                             mislabeling_ratio=0.1)
+
+    curves = np.array([[0.0, 0.5, 0.5, 1.0], [0.5, 0.5, 1.0, 1.0]], dtype=np.float32)
+    mean_curve = np.mean(curves, axis=0)
+    roc = float(np.mean(mean_curve))
+
+    os.makedirs("./tmp_test_bench_display/method1")
+    evaluator._MislabelingDetectorEvaluator__save("./tmp_test_bench_display/method1/data", curves, mean_curve, roc)
+    result = BenchmarkDisplay.load_bench_result("./tmp_test_bench_display/method1/data.npz")
+
+    assert list(result.keys()) == ["method1"]
+    result_curves, result_mean_curve, result_roc = result["method1"]
+    assert np.max(np.abs(result_curves - curves)) < 1E-6
+    assert np.max(np.abs(result_mean_curve - mean_curve)) < 1E-6
+    assert isinstance(result_roc, float)
+    assert np.abs(result_roc - roc) < 1E-6
+
+    BenchmarkDisplay.plot_bench(result, path_to_save="./tmp_test_bench_display/bench.png")
+    plt.close("all")
+    assert os.path.exists("./tmp_test_bench_display/bench.png")
+    shutil.rmtree("./tmp_test_bench_display/")
+
+
+def test_sort_influences_indexes():
+    np.random.seed(0)
+    influences_values = np.random.permutation(1000).astype(np.float32).reshape((-1, 1)) / 10.
+
+    sorted_indexes = MislabelingDetectorEvaluator._sort_influences_indexes(influences_values)
+    assert np.array_equal(sorted_indexes, np.argsort(-np.squeeze(influences_values)))
+    assert np.all(np.diff(np.squeeze(influences_values)[sorted_indexes]) <= 0.)
+
+    for top_k in [1, 10, 999, 1000, 2000]:
+        top_k_indexes = MislabelingDetectorEvaluator._sort_influences_indexes(influences_values, top_k)
+        assert np.array_equal(top_k_indexes, sorted_indexes[:top_k])
+
+
+def test_models_saver_to_disk():
+    tf.random.set_seed(0)
+    x = tf.random.normal((32, 3))
+    y = tf.random.normal((32, 1))
+
+    model = tf.keras.Sequential([tf.keras.layers.Input(shape=(3,)), tf.keras.layers.Dense(1)])
+    optimizer = tf.keras.optimizers.SGD(learning_rate=0.01)
+    model.compile(optimizer=optimizer, loss="mse")
+
+    nb_threads = threading.active_count()
+    model_saver = ModelsSaver([0, 2], optimizer, saving_path="./tmp_test_models_saver")
+    model.fit(x, y, batch_size=8, epochs=3, callbacks=[model_saver], verbose=0)
+
+    # the writing thread is stopped at the end of the training
+    assert threading.active_count() == nb_threads
+
+    saved_weights = []
+    for epoch in [0, 2]:
+        with np.load(f"./tmp_test_models_saver/model_ep_{epoch:06d}.npz") as checkpoint:
+            saved_weights.append([checkpoint[f"arr_{i}"] for i in range(len(checkpoint.files))])
+    assert not os.path.exists("./tmp_test_models_saver/model_ep_000001.npz")
+    shutil.rmtree("./tmp_test_models_saver/")
+
+    assert len(saved_weights) == len(model_saver.checkpoint_weights)
+    for checkpoint_weights, expected_weights in zip(saved_weights, model_saver.checkpoint_weights):
+        assert len(checkpoint_weights) == len(expected_weights)
+        for w, expected_w in zip(checkpoint_weights, expected_weights):
+            assert np.max(np.abs(w - expected_w)) < 1E-6
+    # the last checkpoint is the one of the trained model
+    for w, expected_w in zip(saved_weights[-1], model.get_weights()):
+        assert np.max(np.abs(w - expected_w)) < 1E-6
+
+
+def test_models_saver_checkpoints():
+    tf.random.set_seed(0)
+    x = tf.random.normal((32, 3))
+    y = tf.random.normal((32, 1))
+
+    model = tf.keras.Sequential([tf.keras.layers.Input(shape=(3,)), tf.keras.layers.Dense(1)])
+    optimizer = tf.keras.optimizers.SGD(learning_rate=0.1)
+    model.compile(optimizer=optimizer, loss="mse")
+
+    model_saver = ModelsSaver([0, 1, 2], optimizer)
+    model.fit(x, y, batch_size=8, epochs=3, callbacks=[model_saver], verbose=0)
+
+    # the snapshots are copies that are not modified by the later epochs
+    assert len(model_saver.checkpoint_weights) == 3
+    assert len(model_saver.learning_rates) == 3
+    assert np.max(np.abs(model_saver.checkpoint_weights[0][0] - model_saver.checkpoint_weights[2][0])) > 1E-6
+    for w, expected_w in zip(model_saver.checkpoint_weights[-1], model.get_weights()):
+        assert np.max(np.abs(w - expected_w)) < 1E-6
+
+    models = model_saver.get_models()
+    assert len(models) == 3
+    assert len({id(m) for m in models}) == 3
+    for checkpoint_model, weights in zip(models, model_saver.checkpoint_weights):
+        assert checkpoint_model is not model
+        for w, expected_w in zip(checkpoint_model.get_weights(), weights):
+            assert np.max(np.abs(w - expected_w)) < 1E-6
+        pred = checkpoint_model(x)
+        expected_pred = tf.matmul(x, weights[0]) + weights[1]
+        assert np.max(np.abs(pred - expected_pred)) < 1E-5
+
+    # model_at restores each checkpoint into a single shared model
+    template = model_saver.model_at(0)
+    for index, weights in enumerate(model_saver.checkpoint_weights):
+        checkpoint_model = model_saver.model_at(index)
+        assert checkpoint_model is template
+        for w, expected_w in zip(checkpoint_model.get_weights(), weights):
+            assert np.max(np.abs(w - expected_w)) < 1E-6
+    # restoring a checkpoint does not modify the trained model
+    for w, expected_w in zip(model.get_weights(), model_saver.checkpoint_weights[-1]):
+        assert np.max(np.abs(w - expected_w)) < 1E-6
+
+
+def test_models_saver_write_error(monkeypatch):
+    x = tf.random.normal((32, 3))
+    y = tf.random.normal((32, 1))
+
+    model = tf.keras.Sequential([tf.keras.layers.Input(shape=(3,)), tf.keras.layers.Dense(1)])
+    optimizer = tf.keras.optimizers.SGD(learning_rate=0.01)
+    model.compile(optimizer=optimizer, loss="mse")
+
+    def failing_write(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(np, "savez_compressed", failing_write)
+    nb_threads = threading.active_count()
+    model_saver = ModelsSaver([0], optimizer, saving_path="./tmp_test_models_saver_error")
+    try:
+        # the errors of the background writes are raised at the end of the training
+        with pytest.raises(OSError, match="disk full"):
+            model.fit(x, y, batch_size=8, epochs=2, callbacks=[model_saver], verbose=0)
+        assert threading.active_count() == nb_threads
+    finally:
+        shutil.rmtree("./tmp_test_models_saver_error/")
+
+
+def test_models_saver_without_train_begin():
+    model = tf.keras.Sequential([tf.keras.layers.Input(shape=(3,)), tf.keras.layers.Dense(1)])
+    optimizer = tf.keras.optimizers.SGD(learning_rate=0.01)
+    model.compile(optimizer=optimizer, loss="mse")
+
+    # drive the callback by hand, without on_train_begin being called
+    model_saver = ModelsSaver([0], optimizer, saving_path="./tmp_test_models_saver_manual")
+    model_saver.set_model(model)
+    model_saver.on_epoch_end(0, logs={})
+    model_saver.on_train_end()
+
+    with np.load("./tmp_test_models_saver_manual/model_ep_000000.npz") as checkpoint:
+        saved_weights = [checkpoint[f"arr_{i}"] for i in range(len(checkpoint.files))]
+    shutil.rmtree("./tmp_test_models_saver_manual/")
+
+    for w, expected_w in zip(saved_weights, model.get_weights()):
+        assert np.max(np.abs(w - expected_w)) < 1E-6
+
+
+def test_save_config(monkeypatch):
+    size = 10
+    training_dataset = tf.data.Dataset.from_tensor_slices((tf.zeros((size, 1)), tf.zeros((size, 2))))
+    config = {1: 2, "name": "experiment", "params": {"lr": 0.1}}
+    evaluator = MislabelingDetectorEvaluator(training_dataset,
+                                             test_dataset=None,
+                                             training_procedure=MockTrainingProcedure(),
+                                             nb_classes=2,
+                                             mislabeling_ratio=0.1,
+                                             config=config)
+
+    os.makedirs("./tmp_test_save_config")
+    # the file is the same whether orjson is available or not
+    evaluator._MislabelingDetectorEvaluator__save_config("./tmp_test_save_config/config_orjson.json")
+    monkeypatch.setattr(base_benchmark, "orjson", None)
+    evaluator._MislabelingDetectorEvaluator__save_config("./tmp_test_save_config/config_json.json")
+
+    with open("./tmp_test_save_config/config_orjson.json", encoding="utf-8") as fp:
+        orjson_config = fp.read()
+    with open("./tmp_test_save_config/config_json.json", encoding="utf-8") as fp:
+        json_config = fp.read()
+    shutil.rmtree("./tmp_test_save_config/")
+
+    assert orjson_config == json_config
+    assert json.loads(json_config) == {"1": 2, "name": "experiment", "params": {"lr": 0.1}}
+
+
+def test_evaluate_distribute_strategy():
+    size = 64
+    class_nbr = 3
+    x = tf.random.normal((size, 4))
+    y = tf.one_hot(np.arange(size) % class_nbr, class_nbr)
+    dataset = tf.data.Dataset.from_tensor_slices((x, y))
+
+    strategy = tf.distribute.MirroredStrategy()
+    training_procedure = DistributedTrainingProcedure()
+    evaluator = MislabelingDetectorEvaluator(dataset,
+                                             test_dataset=dataset,
+                                             training_procedure=training_procedure,
+                                             nb_classes=class_nbr,
+                                             mislabeling_ratio=0.2,
+                                             train_batch_size=16,
+                                             test_batch_size=16,
+                                             distribute_strategy=strategy)
+
+    curves, mean_curve, roc = evaluator.evaluate(FirstOrderFactory('exact'), nbr_of_evaluation=2, verbose=False)
+
+    # the models are trained within the strategy's scope
+    assert training_procedure.strategies == [strategy, strategy]
+    assert curves.shape == (2, size)
+    assert not np.any(np.isnan(curves))
+    assert mean_curve.shape == (size,)
+    assert 0. <= roc <= 1.
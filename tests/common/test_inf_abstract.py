@@ -58,3 +58,53 @@ def test_instantiation():
                 normalize=normalize
             )
             assert isinstance(influence_calculator.ihvp_calculator, classes)
+
+
+def _build_self_influence_calculator():
+    model = Sequential([Input(shape=(1, 3)), Dense(2, use_bias=False), Dense(1, use_bias=False)])
+    model.build(input_shape=(1, 3))
+    influence_model = InfluenceModel(model, start_layer=-1, loss_function=MeanSquaredError(reduction=Reduction.NONE))
+
+    inputs = tf.random.normal((8, 1, 3))
+    target = tf.random.normal((8, 1))
+    train_set = tf.data.Dataset.from_tensor_slices((inputs, target))
+    influence_calculator = FirstOrderInfluenceCalculator(influence_model, train_set.batch(4), "exact")
+
+    return influence_calculator, train_set
+
+
+def _expected_influence_values(influence_calculator, train_set):
+    batches_inf = [inf_val for _, inf_val in influence_calculator.compute_influence_values(train_set)]
+    return tf.concat(batches_inf, axis=0)
+
+
+def test_compute_influence_values_known_cardinality():
+    """
+    Test that the influence values gathered in a tensor match the ones of the batched dataset when the cardinality
+    is known, with even batches, a smaller last batch or a larger one
+    """
+    influence_calculator, train_set = _build_self_influence_calculator()
+
+    for batched_set in [train_set.batch(4), train_set.batch(3),
+                        train_set.take(3).batch(3).concatenate(train_set.batch(5))]:
+        assert int(batched_set.cardinality()) > 0
+        inf_val = influence_calculator._compute_influence_values(batched_set)
+        expected_inf_val = _expected_influence_values(influence_calculator, batched_set)
+        assert inf_val.shape == expected_inf_val.shape
+        assert tf.reduce_max(tf.abs(inf_val - expected_inf_val)) < 1E-6
+
+
+def test_compute_influence_values_unknown_cardinality():
+    """
+    Test that the influence values gathered in a tensor match the ones of the batched dataset when the cardinality
+    is unknown
+    """
+    influence_calculator, train_set = _build_self_influence_calculator()
+
+    batched_set = train_set.filter(lambda x, y: True).batch(3)
+    assert int(batched_set.cardinality()) < 0
+    inf_val = influence_calculator._compute_influence_values(batched_set)
+    expected_inf_val = _expected_influence_values(influence_calculator, batched_set)
+    assert inf_val.shape == (8, 1)
+    assert inf_val.shape == expected_inf_val.shape
+    assert tf.reduce_max(tf.abs(inf_val - expected_inf_val)) < 1E-6
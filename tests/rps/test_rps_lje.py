@@ -64,40 +64,19 @@ def test_alpha():
         loss = loss_function(targets_train, logits)
     grads = tape.jacobian(loss, perturbed_model.weights)[0]
 
-    # Divide grads by feature maps
-    grads_div_feature_maps = []
-    for i in range(inputs_train.shape[0]):
-        feature_map = tf.reshape(feature_maps[i], (-1, 1)) if len(feature_maps[i].shape) == 1 else feature_maps[i]
-        divisor = tf.tile(
-            tf.cast(tf.shape(feature_map)[0], feature_map.dtype) * feature_map +
-            tf.constant(1e-5, dtype=feature_map.dtype),
-            (1, grads.shape[-1])
-        )
-        grads_div_feature_maps.append(tf.divide(grads[i], divisor))
-    grads_div_feature_maps = tf.convert_to_tensor(grads_div_feature_maps)
-    second_term = []
-    for i in range(inputs_train.shape[0]):
-        second_term.append(ihvp._compute_ihvp_single_batch(
-            tf.expand_dims(grads_div_feature_maps[i], axis=0), use_gradient=False
-        ))
-    second_term = tf.convert_to_tensor(second_term)
-    second_term = tf.reshape(second_term, grads.shape)
+    # Divide grads by feature maps, the divisor is computed once for the whole batch
+    feature_maps_expanded = tf.expand_dims(feature_maps, axis=-1)
+    divisor = tf.cast(tf.shape(feature_maps)[1], feature_maps.dtype) * feature_maps_expanded + \
+        tf.constant(1e-5, dtype=feature_maps.dtype)
+    grads_div_feature_maps = tf.divide(grads, divisor)
+    # a single IHVP computation for all the samples
+    second_term = ihvp._compute_ihvp_single_batch((grads_div_feature_maps,), use_gradient=False)
+    second_term = tf.reshape(tf.transpose(second_term), grads.shape)
     second_term = tf.reduce_sum(second_term, axis=1)
 
     # Now, compute the first term
     # first term is weights divided by feature maps
-    weights = [w for w in perturbed_model.weights]
-    first_term = []
-    for i in range(inputs_train.shape[0]):
-        feature_map = tf.reshape(feature_maps[i], (-1, 1)) if len(feature_maps[i].shape) == 1 else feature_maps[i]
-        divisor = tf.tile(
-            tf.cast(tf.shape(feature_map)[0], feature_map.dtype) * feature_map +
-            tf.constant(1e-5, dtype=feature_map.dtype),
-            (1, grads.shape[-1])
-        )
-        first_term.append(tf.divide(weights, divisor))
-    first_term = tf.convert_to_tensor(first_term)
-    first_term = tf.reshape(first_term, grads.shape)
+    first_term = tf.divide(tf.expand_dims(perturbed_model.weights[0], axis=0), divisor)
     first_term = tf.reduce_sum(first_term, axis=1)
 
     # Combine to get alpha_test